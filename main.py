@@ -1,6 +1,57 @@
-import matplotlib.pyplot as plt
+import multiprocessing
 import numpy as np
+import os
+import sys
 import time
+from numba import njit
+
+# Number of candidates stored in each 9-bit domain mask, indexed by the mask itself.
+POPCOUNT = np.array([bin(i).count('1') for i in range(512)], dtype=np.uint8)
+
+# Domain mask of each character of a puzzle string: '.' is an empty cell and '1'-'9' are assigned values
+DOMAIN_OF_CHARACTER = np.zeros(256, dtype=np.uint16)
+DOMAIN_OF_CHARACTER[ord('.')] = 0x1FF
+for d in range(9):
+    DOMAIN_OF_CHARACTER[ord('1') + d] = 1 << d
+
+@njit(cache=True, inline='always')
+def is_empty(domain):
+    """
+    Returns True if the domain mask has no values left.
+    """
+    return domain == 0
+
+@njit(cache=True, inline='always')
+def is_singleton(domain):
+    """
+    Returns True if the domain mask has exactly one value, i.e., a single bit is set.
+    """
+    return domain != 0 and (domain & (domain - 1)) == 0
+
+def _build_unit_peers():
+    """
+    Returns three 81 x 8 matrices whose row r * 9 + c lists the indices of the other variables in the
+    same row, column and unit as (r, c), respectively.
+    """
+    peers_row = np.empty((81, 8), dtype=np.int8)
+    peers_col = np.empty((81, 8), dtype=np.int8)
+    peers_box = np.empty((81, 8), dtype=np.int8)
+    for index in range(81):
+        row, column = divmod(index, 9)
+        row_init = (row // 3) * 3
+        column_init = (column // 3) * 3
+
+        peers_row[index] = [row * 9 + j for j in range(9) if j != column]
+        peers_col[index] = [i * 9 + column for i in range(9) if i != row]
+        peers_box[index] = [i * 9 + j for i in range(row_init, row_init + 3) for j in range(column_init, column_init + 3)
+                            if i != row or j != column]
+    return peers_row, peers_col, peers_box
+
+PEERS_ROW, PEERS_COL, PEERS_BOX = _build_unit_peers()
+
+# The 20 distinct variables sharing a row, column or unit with each variable
+PEERS = np.array([sorted(set(r) | set(c) | set(b)) for r, c, b in zip(PEERS_ROW, PEERS_COL, PEERS_BOX)],
+                 dtype=np.int8)
 
 class PlotResults:
     """
@@ -18,12 +69,15 @@ class PlotResults:
         
         filename is the name of the file in which the plot will be saved.
         """
+        # Imported here so that running the solver doesn't pay for loading matplotlib
+        import matplotlib.pyplot as plt
+
         _, ax = plt.subplots()
         ax.scatter(data1, data2, s=100, c="g", alpha=0.5, cmap=plt.cm.coolwarm, zorder=10)
     
         lims = [
-        np.min([ax.get_xlim(), ax.get_ylim()]),  # min of both axes
-        np.max([ax.get_xlim(), ax.get_ylim()]),  # max of both axes
+        min(*ax.get_xlim(), *ax.get_ylim()),  # min of both axes
+        max(*ax.get_xlim(), *ax.get_ylim()),  # max of both axes
         ]
     
         ax.plot(lims, lims, 'k-', alpha=0.75, zorder=0)
@@ -39,31 +93,79 @@ class Grid:
     """
     Class to represent an assignment of values to the 81 variables defining a Sudoku puzzle. 
 
-    Variable _cells stores a matrix with 81 entries, one for each variable in the puzzle. 
-    Each entry of the matrix stores the domain of a variable. Initially, the domains of variables
-    that need to have their values assigned are 123456789; the other domains are limited to the value
-    initially assigned on the grid. Backtracking search and AC3 reduce the the domain of the variables 
-    as they proceed with search and inference.
+    Variable _cells stores a flat array with 81 entries, one for each variable in the puzzle; the variable
+    (row, column) is stored at index row * 9 + column. Each entry of the array stores the domain of a
+    variable as a 9-bit mask of uint16, where bit d - 1 is set if the value d is still in the domain.
+    Initially, the domains of variables that need to have their values assigned are 0x1FF (123456789);
+    the other domains are limited to the value initially assigned on the grid. Backtracking search and
+    AC3 reduce the the domain of the variables as they proceed with search and inference.
+
+    Variable _trail stores the (row * 9 + column, old domain) pairs of every domain reduced since the
+    puzzle was read, so that backtracking can undo an assignment instead of copying the grid. Each entry
+    removes at least one value from a domain, so the trail never holds more than 81 * 8 entries.
+
+    Variable _unassigned counts the variables whose domain is not of size 1. It is kept up to date by
+    read_file, assign, undo and AC3, so the puzzle is solved when it reaches zero.
     """
     def __init__(self):
-        self._cells = []
-        self._complete_domain = "123456789"
         self._width = 9
+        self._cells = np.empty(self._width * self._width, dtype=np.uint16)
+        self._complete_domain = 0x1FF
+        self._trail = np.empty((self._width * self._width * (self._width - 1), 2), dtype=np.int16)
+        self._trail_len = 0
+        self._unassigned = self._width * self._width
+        self._initial_singletons = np.empty(0, dtype=np.intp)
 
     def copy(self):
         """
         Returns a copy of the grid. 
         """
         copy_grid = Grid()
-        copy_grid._cells = [row.copy() for row in self._cells]
+        copy_grid._cells = self._cells.copy()
+        copy_grid._trail = self._trail.copy()
+        copy_grid._trail_len = self._trail_len
+        copy_grid._unassigned = self._unassigned
+        copy_grid._initial_singletons = self._initial_singletons
         return copy_grid
 
+    def get_trail_length(self):
+        """
+        Returns the number of domain reductions recorded on the trail. 
+        """
+        return self._trail_len
+
+    def assign(self, row, column, value):
+        """
+        Reduces the domain of (row, column) to the value, given as a single-bit mask, and records it on the trail.
+        """
+        self._trail_len, self._unassigned = _assign(self._cells, row * self._width + column, value,
+                                                    self._trail, self._trail_len, self._unassigned)
+
+    def undo(self, trail_length):
+        """
+        Restores the domains reduced after the trail had trail_length entries, most recent first.
+        """
+        self._trail_len, self._unassigned = _undo(self._cells, self._trail, self._trail_len, trail_length,
+                                                  self._unassigned)
+
     def get_cells(self):
         """
-        Returns the matrix with the domains of all variables in the puzzle.
+        Returns the flat array with the domains of all variables in the puzzle.
         """
         return self._cells
 
+    def get_initial_singletons(self):
+        """
+        Returns the indices (row * 9 + column) of the variables whose values are assigned in the puzzle read.
+        """
+        return self._initial_singletons
+
+    def get(self, row, column):
+        """
+        Returns the domain of the variable (row, column).
+        """
+        return self._cells[row * self._width + column]
+
     def get_width(self):
         """
         Returns the width of the grid.
@@ -72,7 +174,8 @@ class Grid:
 
     def read_file(self, string_puzzle):
         """
-        Reads a Sudoku puzzle from string and initializes the matrix _cells. 
+        Reads a Sudoku puzzle from string and initializes the array _cells. Leading and trailing
+        whitespace is ignored; a ValueError is raised unless the rest is 81 characters of '.' and '1'-'9'.
 
         This is a valid input string:
 
@@ -94,20 +197,20 @@ class Grid:
         | 1 . 4 | . . . | . . . | 
         - - - - - - - - - - - - - 
         """
-        i = 0
-        row = []
-        for p in string_puzzle:
-            if p == '.':
-                row.append(self._complete_domain)
-            else:
-                row.append(p)
+        string_puzzle = string_puzzle.strip()
+        if len(string_puzzle) != self._width * self._width:
+            raise ValueError("A puzzle must have 81 characters, got " + str(len(string_puzzle)))
 
-            i += 1
+        # Characters other than '.' and '1'-'9' (including non-ASCII ones) map to an empty domain
+        cells = DOMAIN_OF_CHARACTER[np.frombuffer(string_puzzle.encode(), dtype=np.uint8)]
+        if len(cells) != self._width * self._width or not cells.all():
+            raise ValueError("A puzzle may only contain the characters '.' and '1'-'9': " + string_puzzle)
+        self._cells = cells
+
+        # The values initially assigned on the grid seed the queue of the pre-processing AC3
+        self._initial_singletons = np.flatnonzero(self._cells != self._complete_domain)
+        self._unassigned = self._width * self._width - len(self._initial_singletons)
 
-            if i % self._width == 0:
-                self._cells.append(row)
-                row = []
-            
     def print(self):
         """
         Prints the grid on the screen. Example:
@@ -135,9 +238,10 @@ class Grid:
             print('|', end=" ")
 
             for j in range(self._width):
-                if len(self._cells[i][j]) == 1:
-                    print(self._cells[i][j], end=" ")
-                elif len(self._cells[i][j]) > 1:
+                domain = self._cells[i * self._width + j]
+                if POPCOUNT[domain] == 1:
+                    print(int(domain).bit_length(), end=" ")
+                elif POPCOUNT[domain] > 1:
                     print('.', end=" ")
                 else:
                     print(';', end=" ")
@@ -156,40 +260,51 @@ class Grid:
         """
         Print the domain of each variable for a given grid of the puzzle.
         """
-        for row in self._cells:
-            print(row)
+        for row in self._cells.reshape(self._width, self._width):
+            print([domain_to_string(domain) for domain in row])
 
     def is_solved(self):
         """
         Returns True if the puzzle is solved and False otherwise. 
+
+        AC3 removes every assigned value from the domains of its peers, so a grid where all
+        variables are assigned is consistent and it is enough to check the count of unassigned variables.
         """
-        for i in range(self._width):
-            for j in range(self._width):
-                if len(self._cells[i][j]) > 1 or not self.is_value_consistent(self._cells[i][j], i, j):
-                    return False
-        return True
-    
-    def is_value_consistent(self, value, row, column):
-        for i in range(self.get_width()):
-            if i == column: continue
-            if self.get_cells()[row][i] == value:
-                return False
-        
-        for i in range(self.get_width()):
-            if i == row: continue
-            if self.get_cells()[i][column] == value:
-                return False
+        return self._unassigned == 0
 
-        row_init = (row // 3) * 3
-        column_init = (column // 3) * 3
+@njit(cache=True)
+def _least_constraining_values(cells, index, peers):
+    """
+    Returns the values in the domain of index, as single-bit masks, ordered by the number of peers
+    of index that have the value in their domains, i.e., the least constraining value first. Ties
+    are broken by the smallest value.
+    """
+    domain = cells[index]
+    values = np.empty(9, dtype=np.int64)
+    ruled_out = np.empty(9, dtype=np.int64)
+
+    n_values = 0
+    while domain:
+        bit = domain & -domain
+        domain ^= bit
+
+        count = 0
+        for p in peers[index]:
+            if cells[p] & bit:
+                count += 1
+
+        values[n_values] = bit
+        ruled_out[n_values] = count
+        n_values += 1
+
+    order = np.argsort(ruled_out[:n_values], kind='mergesort')
+    return values[:n_values][order]
 
-        for i in range(row_init, row_init + 3):
-            for j in range(column_init, column_init + 3):
-                if i == row and j == column:
-                    continue
-                if self.get_cells()[i][j] == value:
-                    return False
-        return True
+def domain_to_string(domain):
+    """
+    Returns the string representation of a domain mask, e.g., 0b000010101 is returned as "135".
+    """
+    return ''.join(str(d + 1) for d in range(9) if domain & (1 << d))
 
 class VarSelector:
     """
@@ -206,9 +321,11 @@ class FirstAvailable(VarSelector):
     """
     def select_variable(self, grid):
         # Implement here the first available heuristic
-        for i in range(grid.get_width()):
-            for j in range(grid.get_width()):
-                if len(grid.get_cells()[i][j]) > 1:
+        cells = grid.get_cells()
+        width = grid.get_width()
+        for i in range(width):
+            for j in range(width):
+                if POPCOUNT[cells[i * width + j]] > 1:
                     return (i, j)
         # If no variable with domain size greater than 1 is found
         return None
@@ -216,93 +333,210 @@ class FirstAvailable(VarSelector):
 class MRV(VarSelector):
     """ Implements the MRV heuristic, which returns one of the variables with smallest domain. """
     def select_variable(self, grid):
-        min_domain_size = float('inf')
-        selected_var = None
-        
-        for i in range(grid.get_width()):
-            for j in range(grid.get_width()):
-                domain_size = len(grid.get_cells()[i][j])
-                #find the one with the smallest domain size possible
-                if domain_size > 1 and domain_size < min_domain_size:
-                    min_domain_size = domain_size
-                    selected_var = (i, j)
-        return selected_var
+        domain_sizes = POPCOUNT[grid.get_cells()]
+
+        #Assigned variables can't be selected; argmin returns the first of the smallest domains
+        domain_sizes[domain_sizes <= 1] = 255
+        index = domain_sizes.argmin()
+
+        if domain_sizes[index] == 255:
+            return None
+        return divmod(int(index), grid.get_width())
+
+class ValueSelector:
+    """
+    Interface for ordering the values of the domain of a variable in a partial assignment. 
+
+    Extend this class when implementing a new heuristic for value ordering.
+    """
+    def order_values(self, grid, row, column):
+        pass
+
+class AscendingValues(ValueSelector):
+    """
+    Tries the values in increasing order; returns them as single-bit masks.
+    """
+    def order_values(self, grid, row, column):
+        domain = int(grid.get(row, column))
+        return [1 << d for d in range(grid.get_width()) if domain & (1 << d)]
+
+class LCV(ValueSelector):
+    """
+    Implements the least constraining value heuristic, which tries first the values that are in the
+    domains of the fewest peers of the variable, i.e., the values that leave the most options open.
+    """
+    def order_values(self, grid, row, column):
+        return _least_constraining_values(grid.get_cells(), row * grid.get_width() + column, PEERS)
+
+
+@njit(cache=True)
+def _propagate(cells, index, peers, assigned, trail, trail_len):
+    """
+    Given the flat grid (cells) and a variable index (row * 9 + column) whose domain is of size 1,
+    removes its value from the 8 variables listed in peers[index], i.e., its row, column or unit.
+    The variables whose domains become of size 1 are written to assigned, and every domain that changes
+    is pushed to the trail as (index, old domain). Returns the number of assigned variables,
+    a flag that is True if a domain became empty, and the new length of the trail.
+    """
+    n_assigned = 0
+    removed = ~cells[index]
+
+    for p in peers[index]:
+        old_domain = cells[p]
+        new_domain = old_domain & removed
+
+        if is_empty(new_domain):
+            return n_assigned, True, trail_len
+
+        if new_domain != old_domain:
+            if is_singleton(new_domain):
+                assigned[n_assigned] = p
+                n_assigned += 1
+
+            trail[trail_len, 0] = p
+            trail[trail_len, 1] = old_domain
+            trail_len += 1
+            cells[p] = new_domain
 
+    return n_assigned, False, trail_len
+
+@njit(cache=True)
+def _assign(cells, index, value, trail, trail_len, unassigned):
+    """
+    Reduces the domain of index (row * 9 + column) in the flat grid (cells) to value, pushing the old
+    domain to the trail. Returns the new length of the trail and the new number of unassigned variables.
+    """
+    if not is_singleton(cells[index]):
+        unassigned -= 1
+    trail[trail_len, 0] = index
+    trail[trail_len, 1] = cells[index]
+    cells[index] = value
+    return trail_len + 1, unassigned
+
+@njit(cache=True)
+def _undo(cells, trail, trail_len, mark, unassigned):
+    """
+    Restores the domains pushed to the trail after it had mark entries, most recent first. Returns
+    the new length of the trail (mark) and the new number of unassigned variables.
+    """
+    for k in range(trail_len - 1, mark - 1, -1):
+        index = trail[k, 0]
+        # Domains on the trail were reduced from more than one value
+        if is_singleton(cells[index]):
+            unassigned += 1
+        cells[index] = trail[k, 1]
+    return mark, unassigned
+
+@njit(cache=True)
+def _enqueue(pending, plen, in_queue_lo, in_queue_hi, index):
+    """
+    Pushes the variable index (row * 9 + column) to the worklist unless its bit is already set in
+    the 128-bit in-queue set formed by in_queue_lo and in_queue_hi. Returns the new worklist length
+    and the updated halves of the set.
+    """
+    if index < 64:
+        bit = np.uint64(1) << np.uint64(index)
+        if in_queue_lo & bit:
+            return plen, in_queue_lo, in_queue_hi
+        in_queue_lo |= bit
+    else:
+        bit = np.uint64(1) << np.uint64(index - 64)
+        if in_queue_hi & bit:
+            return plen, in_queue_lo, in_queue_hi
+        in_queue_hi |= bit
+
+    pending[plen] = index
+    return plen + 1, in_queue_lo, in_queue_hi
+
+@njit(cache=True)
+def _consistency(cells, pending, plen, peers_row, peers_col, peers_box, trail, trail_len, unassigned):
+    """
+    Runs AC3 on the flat grid (cells) from the first plen variables (row * 9 + column) stored in the
+    worklist pending, which must be able to hold every variable of the grid. Every domain reduced is
+    pushed to the trail so that it can be undone. Returns False if a domain became empty, the new
+    length of the trail and the new number of unassigned variables.
+    """
+    in_queue_lo = np.uint64(0)
+    in_queue_hi = np.uint64(0)
+    queued = plen
+    plen = 0
+    for k in range(queued):
+        plen, in_queue_lo, in_queue_hi = _enqueue(pending, plen, in_queue_lo, in_queue_hi, pending[k])
+
+    # A variable is removed from at most 8 other domains of a row, column or unit
+    assigned = np.empty(peers_row.shape[1], dtype=np.int8)
+
+    while plen > 0:
+        plen -= 1
+        index = pending[plen]
+        if index < 64:
+            in_queue_lo &= ~(np.uint64(1) << np.uint64(index))
+        else:
+            in_queue_hi &= ~(np.uint64(1) << np.uint64(index - 64))
+
+        n_assigned, failure, trail_len = _propagate(cells, index, peers_box, assigned, trail, trail_len)
+        unassigned -= n_assigned
+        if failure:
+            return False, trail_len, unassigned  # Failure, domain size reduced to 0
+        for k in range(n_assigned):
+            plen, in_queue_lo, in_queue_hi = _enqueue(pending, plen, in_queue_lo, in_queue_hi, assigned[k])
+
+        n_assigned, failure, trail_len = _propagate(cells, index, peers_col, assigned, trail, trail_len)
+        unassigned -= n_assigned
+        if failure:
+            return False, trail_len, unassigned
+        for k in range(n_assigned):
+            plen, in_queue_lo, in_queue_hi = _enqueue(pending, plen, in_queue_lo, in_queue_hi, assigned[k])
+
+        n_assigned, failure, trail_len = _propagate(cells, index, peers_row, assigned, trail, trail_len)
+        unassigned -= n_assigned
+        if failure:
+            return False, trail_len, unassigned
+        for k in range(n_assigned):
+            plen, in_queue_lo, in_queue_hi = _enqueue(pending, plen, in_queue_lo, in_queue_hi, assigned[k])
+
+    return True, trail_len, unassigned  # Success
 
 class AC3:
     """
     This class implements the methods needed to run AC3 on Sudoku. 
+
+    The propagation itself is done by the module-level functions compiled with numba;
+    this class converts the grid, the queue of variables and the peer tables to their arguments.
     """
+    def _remove_domain(self, peers, grid, row, column):
+        width = grid.get_width()
+        assigned = np.empty(width - 1, dtype=np.int8)
+
+        n_assigned, failure, grid._trail_len = _propagate(grid.get_cells(), row * width + column, peers, assigned,
+                                                          grid._trail, grid._trail_len)
+        grid._unassigned -= n_assigned
+        if failure:
+            return None, True
+
+        return [divmod(int(assigned[k]), width) for k in range(n_assigned)], False
+
     def remove_domain_row(self, grid, row, column):
         """
         Given a matrix (grid) and a cell on the grid (row and column) whose domain is of size 1 (i.e., the variable has its
         value assigned), this method removes the value of (row, column) from all variables in the same row. 
         """
-        variables_assigned = []
-
-        for j in range(grid.get_width()):
-            if j != column:
-                new_domain = grid.get_cells()[row][j].replace(grid.get_cells()[row][column], '')
-
-                if len(new_domain) == 0:
-                    return None, True
-
-                if len(new_domain) == 1 and len(grid.get_cells()[row][j]) > 1:
-                    variables_assigned.append((row, j))
-
-                grid.get_cells()[row][j] = new_domain
-        
-        return variables_assigned, False
+        return self._remove_domain(PEERS_ROW, grid, row, column)
 
     def remove_domain_column(self, grid, row, column):
         """
         Given a matrix (grid) and a cell on the grid (row and column) whose domain is of size 1 (i.e., the variable has its
         value assigned), this method removes the value of (row, column) from all variables in the same column. 
         """
-        variables_assigned = []
-
-        for j in range(grid.get_width()):
-            if j != row:
-                new_domain = grid.get_cells()[j][column].replace(grid.get_cells()[row][column], '')
-                
-                if len(new_domain) == 0:
-                    return None, True
-
-                if len(new_domain) == 1 and len(grid.get_cells()[j][column]) > 1:
-                    variables_assigned.append((j, column))
-
-                grid.get_cells()[j][column] = new_domain
-
-        return variables_assigned, False
+        return self._remove_domain(PEERS_COL, grid, row, column)
 
     def remove_domain_unit(self, grid, row, column):
         """
         Given a matrix (grid) and a cell on the grid (row and column) whose domain is of size 1 (i.e., the variable has its
         value assigned), this method removes the value of (row, column) from all variables in the same unit. 
         """
-        variables_assigned = []
+        return self._remove_domain(PEERS_BOX, grid, row, column)
 
-        row_init = (row // 3) * 3
-        column_init = (column // 3) * 3
-
-        for i in range(row_init, row_init + 3):
-            for j in range(column_init, column_init + 3):
-                if i == row and j == column:
-                    continue
-
-                new_domain = grid.get_cells()[i][j].replace(grid.get_cells()[row][column], '')
-
-                if len(new_domain) == 0:
-                    return None, True
-
-                if len(new_domain) == 1 and len(grid.get_cells()[i][j]) > 1:
-                    variables_assigned.append((i, j))
-
-                grid.get_cells()[i][j] = new_domain
-                
-        return variables_assigned, False
-
-    
     def pre_process_consistency(self, grid):
         """
         This method enforces arc consistency for the initial grid of the puzzle.
@@ -310,162 +544,202 @@ class AC3:
         The method runs AC3 for the arcs involving the variables whose values are 
         already assigned in the initial grid. 
         """
-        Q = set()
-        for i in range(grid.get_width()):
-            for j in range(grid.get_width()):
-                #If the domain is reduced to only 1 number, put it in the queue
-                if len(grid.get_cells()[i][j]) == 1:
-                    Q.add((i, j))
-        
+        #The variables whose domains are reduced to only 1 number were found while reading the puzzle
+        Q = grid.get_initial_singletons()
+
         return self.consistency(grid,Q)
 
-   
     def consistency(self,grid, Q):
         """
         This is a domain-specific implementation of AC3 for Sudoku. 
         The method returns False if AC3 detected that the problem can't be solved with the current
         partial assignment; the method returns True otherwise. 
-        """
-        
-        while Q:
-            row, col = Q.pop()
-            unit_list, failure1 = self.remove_domain_unit(grid, row, col)
-            column_list, failure2 = self.remove_domain_column(grid, row, col)
-            row_list, failure3 = self.remove_domain_row(grid, row, col)
-
-            if failure1 or failure2 or failure3:
-                return False  # Failure, domain size reduced to 0
 
-            for i in unit_list:
-                Q.add(i)
-            for i in column_list:
-                Q.add(i)
-            for i in row_list:
-                Q.add(i)
+        Q holds the variables to start from, each given by its index row * 9 + column.
+        """
+        pending = np.empty(grid.get_width() * grid.get_width(), dtype=np.int8)
+        pending[:len(Q)] = Q
 
-        return True  # Success
+        consistent, grid._trail_len, grid._unassigned = _consistency(grid.get_cells(), pending, len(Q),
+                                                                     PEERS_ROW, PEERS_COL, PEERS_BOX,
+                                                                     grid._trail, grid._trail_len, grid._unassigned)
+        return consistent
 
 
 class Backtracking:
     """
     Class that implements backtracking search for solving CSPs. 
     """
-    def search(self, grid, var_selector, ac3):
+    def search(self, grid, var_selector, ac3, value_selector=None):
         """
         Implements backtracking search with inference. 
+
+        value_selector orders the values tried for each variable; the values are tried in
+        increasing order if it is not given.
         """
+        if value_selector is None:
+            value_selector = ASCENDING_VALUES
+
         # Run pre-processing consistency check before starting the search
-        ac3.pre_process_consistency(grid)
+        if not ac3.pre_process_consistency(grid):
+            return None
         #Then call backtracksearch on the remainng cells
-        return self.backtrack_search(grid, var_selector, ac3)
+        return self.backtrack_search(grid, var_selector, ac3, value_selector)
 
-    def backtrack_search(self, grid, var_selector, ac3):
+    def backtrack_search(self, grid, var_selector, ac3, value_selector):
         """
         Backtracks the search and checks new values when failure encountered with current values.
+
+        The search is iterative: each frame of the stack stores a variable (row * 9 + column), the
+        values of its domain in the order given by value_selector, the position of the next value
+        to try, and the length of the trail before the variable was assigned, so that failing values
+        are undone instead of copying the grid.
         """
-        if grid.is_solved():
-            return grid
+        width = grid.get_width()
+        stack = []
+        descend = True
 
-        var = var_selector.select_variable(grid)   #Either MRV or FirstAvailable
+        while True:
+            if descend:
+                if grid.is_solved():
+                    return grid
 
-        if var is None:
-            return None
+                var = var_selector.select_variable(grid)   #Either MRV or FirstAvailable
+
+                if var is not None:
+                    row, col = var
+                    values = value_selector.order_values(grid, row, col)
+                    stack.append([row * width + col, values, 0, grid.get_trail_length()])
+
+            if not stack:
+                return None
 
-        row, col = var
+            frame = stack[-1]
+            index, values, position, mark = frame
+            row, col = divmod(index, width)
+
+            #Undo the previous value of the variable and everything AC3 inferred from it
+            grid.undo(mark)
+            descend = False
+
+            #Picks the next value in the order of value_selector
+            while position < len(values):
+                bit = int(values[position])
+                position += 1
+
+                # AC3 already removed the values of the assigned peers from the domain, so
+                # every value left is consistent with them
+                grid.assign(row, col, bit)
 
-        #Arbitrarly picks a domain value 
-        for d in grid.get_cells()[row][col]:
-            if grid.is_value_consistent(d, row, col):
-                
-                #Make copy of the current grid and copy the chosen value
-                new_grid = grid.copy()
-                new_grid.get_cells()[row][col] = d
-                
                 # Run consistency check for the assigned value
-                if not ac3.consistency(new_grid,{(row,col)}):
-                    continue  # Skip this value if consistency check fails
-                
-                #Backtrack and search for otehr values that might pass
-                result = self.backtrack_search(new_grid, var_selector, ac3)
-                if result is not None:
-                    return result
+                if ac3.consistency(grid, (index,)):
+                    descend = True
+                    break
 
-        return None
+                grid.undo(mark)
+
+            if descend:
+                frame[2] = position
+            else:
+                # All values failed, go back to the previous variable
+                stack.pop()
 
 
-with open('top95.txt', "r") as file:
-    puzzles = file.read().splitlines()
+# AC3, Backtracking and the selectors keep no state between puzzles, so one instance of each is reused
+AC3_INSTANCE = AC3()
+BACKTRACKING = Backtracking()
+ASCENDING_VALUES = AscendingValues()
 
-# Create instances of the Backtracking class
-backtracking_mrv = Backtracking()
-backtracking_first_available = Backtracking()
+# Variable and value selectors that can be requested by name in solve_one
+VAR_SELECTORS = {'MRV': MRV(), 'FA': FirstAvailable()}
+VALUE_SELECTORS = {'ascending': ASCENDING_VALUES, 'LCV': LCV()}
 
-# Create instances of the Variable Selectors
-var_selector_MRV = MRV()
-var_selector_first = FirstAvailable()
+def solve_one(args):
+    """
+    Solves one puzzle; args is a tuple (puzzle_string, selector_name, value_selector_name), where
+    selector_name is a key of VAR_SELECTORS and value_selector_name a key of VALUE_SELECTORS.
+    Returns whether the puzzle was solved and the running time of the search.
 
-# Lists to store running times for each puzzle
-running_time_mrv_all = []
-running_time_first_available_all = []
+    The function is defined at the top level of the module so that multiprocessing can send it to the workers.
+    """
+    puzzle_string, selector_name, value_selector_name = args
 
-count_MRV = 0
-count_first_available = 0
-start_MRV = time.time()
-# Measure running time for MRV
-for p in puzzles:
     grid = Grid()
-    grid.read_file(p)
+    grid.read_file(puzzle_string)
 
-    ac3 = AC3()
-    start_mrv = time.time()
-    result_MRV = backtracking_mrv.search(grid, var_selector_MRV, ac3)
-    end_mrv = time.time()
-    
-    if result_MRV.is_solved():
-        count_MRV += 1
+    start = time.time()
+    result = BACKTRACKING.search(grid, VAR_SELECTORS[selector_name], AC3_INSTANCE,
+                                 VALUE_SELECTORS[value_selector_name])
+    end = time.time()
 
-    running_time_mrv_all.append(end_mrv - start_mrv)
-end_MRV = time.time()
+    return result is not None and result.is_solved(), end - start
 
-# Measure running time for FirstAvailable
-start_FA = time.time()
-for p in puzzles:
-    grid = Grid()
-    grid.read_file(p)
-
-    ac3 = AC3()
-    start_first_available = time.time()
-    result_first_available = backtracking_first_available.search(grid, var_selector_first, ac3)
-    end_first_available = time.time()
-    if result_first_available.is_solved():
-        count_first_available += 1
-    running_time_first_available_all.append(end_first_available - start_first_available)
-end_FA = time.time()
-
-# Print results
-print("------------------------------------------------------------------------------------------------")
-print("Total Success Count MRV:", count_MRV)
-print("Total Success Count FirstAvailable:", count_first_available)
-print("Total time taken for the MRV to run is : ", end_MRV - start_MRV, " seconds.") 
-print("Total time taken for the FA to run is : ", end_FA - start_FA, " seconds.")
-# Plot results
-print("------------------------------------------------------------------------------------------------")
-print("MRV RUN TIMES: ")
-print(running_time_mrv_all)
-print("This is the maximum it took for MRV to solve a puzzle : ", max(running_time_mrv_all))
-print("------------------------------------------------------------------------------------------------")
-
-print("FA RUN TIMES: ")
-print(running_time_first_available_all)
-print("This is the maximum it took for FirstAvailable to solve a puzzle : ",max(running_time_first_available_all))
-print("------------------------------------------------------------------------------------------------")
-
-#Plot results
-plotter = PlotResults()
-plotter.plot_results(
-    running_time_mrv_all,
-    running_time_first_available_all,
-    "Running Time Backtracking (MRV)",
-    "Running Time Backtracking (FA)",
-    "running_time_plot"
-)
+def warm_up_worker():
+    """
+    Solves an empty grid with every combination of selectors, so that the functions compiled with numba
+    are compiled or loaded from the cache before any puzzle is timed. Used as the initializer of the workers.
+    """
+    for selector_name in VAR_SELECTORS:
+        for value_selector_name in VALUE_SELECTORS:
+            solve_one(('.' * 81, selector_name, value_selector_name))
+
+
+if __name__ == "__main__":
+    with open('top95.txt', "r") as file:
+        puzzles = file.read().splitlines()
+
+    # Values are tried in increasing order unless the least constraining value is asked for with --lcv
+    value_selector_name = 'LCV' if "--lcv" in sys.argv else 'ascending'
+
+    # Compile before forking so that the workers inherit the compiled functions and the totals
+    # below don't include it; the initializer covers workers started without fork
+    warm_up_worker()
+
+    # The puzzles are independent, so each one is solved by a worker process
+    with multiprocessing.Pool(os.cpu_count(), initializer=warm_up_worker) as pool:
+        # Measure running time for MRV
+        start_MRV = time.time()
+        results_mrv = pool.map(solve_one, [(p, 'MRV', value_selector_name) for p in puzzles])
+        end_MRV = time.time()
+
+        # Measure running time for FirstAvailable
+        start_FA = time.time()
+        results_first_available = pool.map(solve_one, [(p, 'FA', value_selector_name) for p in puzzles])
+        end_FA = time.time()
+
+    count_MRV = sum(solved for solved, _ in results_mrv)
+    count_first_available = sum(solved for solved, _ in results_first_available)
+
+    # Lists to store running times for each puzzle
+    running_time_mrv_all = [running_time for _, running_time in results_mrv]
+    running_time_first_available_all = [running_time for _, running_time in results_first_available]
+
+    # Print results
+    print("------------------------------------------------------------------------------------------------")
+    print("Value ordering:", value_selector_name)
+    print("Total Success Count MRV:", count_MRV)
+    print("Total Success Count FirstAvailable:", count_first_available)
+    print("Total time taken for the MRV to run is : ", end_MRV - start_MRV, " seconds.") 
+    print("Total time taken for the FA to run is : ", end_FA - start_FA, " seconds.")
+    # Plot results
+    print("------------------------------------------------------------------------------------------------")
+    print("MRV RUN TIMES: ")
+    print(running_time_mrv_all)
+    print("This is the maximum it took for MRV to solve a puzzle : ", max(running_time_mrv_all))
+    print("------------------------------------------------------------------------------------------------")
+
+    print("FA RUN TIMES: ")
+    print(running_time_first_available_all)
+    print("This is the maximum it took for FirstAvailable to solve a puzzle : ",max(running_time_first_available_all))
+    print("------------------------------------------------------------------------------------------------")
+
+    #Plot results only when asked for with --plot
+    if "--plot" in sys.argv:
+        plotter = PlotResults()
+        plotter.plot_results(
+            running_time_mrv_all,
+            running_time_first_available_all,
+            "Running Time Backtracking (MRV)",
+            "Running Time Backtracking (FA)",
+            "running_time_plot"
+        )